@@ -0,0 +1,70 @@
+"""
+Admission control of writes per wallet.
+
+When WALLET_WRITE_CONCURRENCY is set, at most that many writes of a wallet are in flight at once. Further writes fail
+fast with 429 instead of queuing on the wallet row lock, where they would tie up workers and DB connections needed by
+other wallets. On postgres the slots are transaction level advisory locks, so the limit holds across processes and
+replicas, and waits for the wallet row lock can be bounded by WALLET_LOCK_TIMEOUT_MS. Other databases get a process
+local limit.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+from app.wallet.exceptions import WalletBusy, WalletLockTimeout
+
+LOCK_NOT_AVAILABLE = '55P03'
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+@contextmanager
+def admit_write(wallet_id, limited=True):
+    """Admits a write to the wallet. Must be entered inside a database transaction, slots are released on its end."""
+    limit = settings.WALLET_WRITE_CONCURRENCY if limited else 0
+    if connection.vendor != 'postgresql':
+        with _local_slot(wallet_id, limit):
+            yield
+        return
+
+    with connection.cursor() as cursor:
+        if limit:
+            # Taking the first free slot, advisory locks are keyed by a 32 bit hash of the wallet id and a slot number
+            cursor.execute('SELECT slot FROM generate_series(0, %s) AS slot '
+                           'WHERE pg_try_advisory_xact_lock(%s, slot) LIMIT 1',
+                           [limit - 1, _lock_key(wallet_id)])
+            if cursor.fetchone() is None:
+                raise WalletBusy()
+        if settings.WALLET_LOCK_TIMEOUT_MS:
+            cursor.execute("SELECT set_config('lock_timeout', %s, true)", [f'{settings.WALLET_LOCK_TIMEOUT_MS}ms'])
+
+    try:
+        yield
+    except OperationalError as exc:
+        if getattr(exc.__cause__, 'pgcode', None) == LOCK_NOT_AVAILABLE:
+            raise WalletLockTimeout() from exc
+        raise
+
+
+def _lock_key(wallet_id):
+    return (wallet_id.int & 0xffffffff) - 0x80000000
+
+
+@contextmanager
+def _local_slot(wallet_id, limit):
+    with _in_flight_lock:
+        in_flight = _in_flight.get(wallet_id, 0)
+        if limit and in_flight >= limit:
+            raise WalletBusy()
+        _in_flight[wallet_id] = in_flight + 1
+
+    try:
+        yield
+    finally:
+        with _in_flight_lock:
+            _in_flight[wallet_id] -= 1
+            if not _in_flight[wallet_id]:
+                del _in_flight[wallet_id]
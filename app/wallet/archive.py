@@ -0,0 +1,107 @@
+"""
+Cold archival of old transactions.
+
+Archived transactions are moved to the transactions_archive table and summed per wallet into WalletCheckpoint,
+so balance checks and point-in-time queries don't have to read the archive for recent moments.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce, Greatest
+
+from app.wallet.models import ArchivedTransaction, Transaction, Wallet, WalletCheckpoint
+
+
+def archive_batch(cutoff, batch_size):
+    """Moves up to `batch_size` transactions created before `cutoff` to the archive. Returns the number moved."""
+    with db_transaction.atomic():
+        # Skip locked rows, they are being updated right now and will be picked up by the next run
+        transactions = list(Transaction.objects
+                            .filter(created_at__lt=cutoff)
+                            .order_by('created_at', 'id')
+                            .select_for_update(skip_locked=True)[:batch_size])
+        if not transactions:
+            return 0
+
+        ArchivedTransaction.objects.bulk_create([
+            ArchivedTransaction(id=transaction.id,
+                                wallet_id=transaction.wallet_id,
+                                txid=transaction.txid,
+                                amount=transaction.amount,
+                                created_at=transaction.created_at,
+                                updated_at=transaction.updated_at)
+            for transaction in transactions
+        ])
+
+        sums = defaultdict(Decimal)
+        counts = defaultdict(int)
+        for transaction in transactions:
+            sums[transaction.wallet_id] += transaction.amount
+            counts[transaction.wallet_id] += 1
+
+        for wallet_id, amount in sums.items():
+            updated = (WalletCheckpoint.objects
+                       .filter(wallet_id=wallet_id)
+                       .update(amount=F('amount') + amount,
+                               transactions_count=F('transactions_count') + counts[wallet_id],
+                               archived_until=Greatest('archived_until', cutoff)))
+            if not updated:
+                WalletCheckpoint.objects.create(wallet_id=wallet_id,
+                                                amount=amount,
+                                                transactions_count=counts[wallet_id],
+                                                archived_until=cutoff)
+
+        (Transaction.objects
+         .filter(id__in=[transaction.id for transaction in transactions], created_at__lt=cutoff)
+         .delete())
+
+    return len(transactions)
+
+
+def archived_txids(txids):
+    """
+    Returns the txids among `txids` that belong to archived transactions.
+    Archived txids stay taken, but the unique index of the transactions table no longer covers them. Creates call
+    this after inserting their transactions: an insert of a txid that is being archived waits until the archive
+    run commits, so a check after the insert can't miss it, while a check before it could.
+    """
+    return set(ArchivedTransaction.objects.filter(txid__in=txids).values_list('txid', flat=True))
+
+
+def _wallet_total(queryset):
+    # Sum of the amounts of the wallet of the outer query
+    return Coalesce(Subquery(queryset
+                             .filter(wallet_id=OuterRef('id'))
+                             .order_by()
+                             .values('wallet_id')
+                             .annotate(total=Sum('amount'))
+                             .values('total')),
+                    Decimal('0'), output_field=DecimalField(max_digits=33, decimal_places=18))
+
+
+def balance_at(wallet_id, moment=None):
+    """
+    Wallet balance from its ledger at `moment`, the current balance by default.
+    Moments before the wallet checkpoint are computed from the archive, which is the slow path. The checkpoint and the
+    sums are read by one statement, so they can't miss transactions moved by an archive run committing in between.
+    """
+    live = Transaction.objects.all()
+    archived = ArchivedTransaction.objects.all()
+    if moment is not None:
+        live = live.filter(created_at__lte=moment)
+        archived = archived.filter(created_at__lte=moment)
+
+    checkpoint = WalletCheckpoint.objects.filter(wallet_id=OuterRef('id'))
+    wallets = Wallet.objects.filter(id=wallet_id).annotate(
+        checkpoint_amount=Coalesce(Subquery(checkpoint.values('amount')), Decimal('0'),
+                                   output_field=DecimalField(max_digits=33, decimal_places=18)),
+        checkpoint_until=Subquery(checkpoint.values('archived_until')),
+    )
+    if moment is None:
+        balance = F('checkpoint_amount') + _wallet_total(live)
+    else:
+        balance = Case(When(checkpoint_until__lte=moment, then=F('checkpoint_amount') + _wallet_total(live)),
+                       default=_wallet_total(archived) + _wallet_total(live))
+    return wallets.annotate(ledger_balance=balance).values_list('ledger_balance', flat=True).get()
@@ -0,0 +1,40 @@
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from app.wallet import metrics
+
+# Message of the txid unique validator, also used when a duplicate txid is only caught by the database
+TXID_EXISTS_ERROR = 'transaction with this txid already exists.'
+
+
+class TransactionConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Transaction with this txid already exists with a different wallet or amount.'
+    default_code = 'conflict'
+
+
+class WalletBusy(APIException):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    default_detail = 'Too many concurrent writes to this wallet, retry later.'
+    default_code = 'wallet_busy'
+
+    @property
+    def wait(self):
+        # Sent as the Retry-After header by the exception handler
+        return settings.WALLET_WRITE_RETRY_AFTER
+
+
+class WalletLockTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Timed out waiting for the wallet lock, retry later.'
+    default_code = 'wallet_lock_timeout'
+
+    @property
+    def wait(self):
+        return settings.WALLET_WRITE_RETRY_AFTER
+
+
+def insufficient_balance_error(operation):
+    metrics.INSUFFICIENT_BALANCE.labels(operation).inc()
+    return ValidationError('Insufficient wallet balance. Wallet balance cannot be negative.')
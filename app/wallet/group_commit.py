@@ -0,0 +1,174 @@
+"""
+Group commit of transaction creates.
+
+Creates are queued per wallet and written by worker threads in micro-batches: one wallet row lock, one bulk insert,
+one balance update and one commit per batch instead of per request. A request gets its response only after its batch
+commits, so durability doesn't change. Batches only form when a process serves concurrent requests, e.g. gunicorn
+with --threads.
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections
+from django.db import transaction as db_transaction
+from rest_framework.exceptions import ValidationError
+
+from app.wallet import metrics
+from app.wallet.admission import admit_write
+from app.wallet.archive import archived_txids
+from app.wallet.exceptions import TXID_EXISTS_ERROR, TransactionConflict, WalletBusy, insufficient_balance_error
+from app.wallet.models import ArchivedTransaction, Transaction, Wallet
+
+
+def write_batch(wallet_id, items):
+    """
+    Writes queued creates of one wallet in a single database transaction.
+    `items` are (txid, amount) pairs in arrival order, the balance is checked in that order.
+    Returns a (transaction, replayed) pair or an exception for every item.
+    """
+    results = []
+    # The queue already limits writes per wallet, only the lock timeout of admission control applies here
+    with db_transaction.atomic(), admit_write(wallet_id, limited=False):
+        with metrics.LOCK_WAIT.labels('create').time():
+            wallet = Wallet.objects.select_for_update().get(id=wallet_id)
+
+        txids = [txid for txid, _ in items]
+        stored = {transaction.txid: transaction for transaction in Transaction.objects.filter(txid__in=txids)}
+        stored.update((transaction.txid, transaction)
+                      for transaction in ArchivedTransaction.objects.filter(txid__in=txids))
+
+        balance = wallet.balance
+        created = []
+        for txid, amount in items:
+            transaction = stored.get(txid)
+            if transaction is not None:
+                results.append(replay(wallet_id, amount, transaction))
+                continue
+
+            if balance + amount < 0:
+                results.append(insufficient_balance_error('create'))
+                continue
+
+            balance += amount
+            transaction = Transaction(wallet=wallet, txid=txid, amount=amount)
+            stored[txid] = transaction
+            created.append(transaction)
+            results.append((transaction, False))
+
+        if created:
+            Transaction.objects.bulk_create(created)
+            if archived_txids([transaction.txid for transaction in created]):
+                # Archived by a run that committed after the lookup above, write() retries one by one
+                raise IntegrityError('txid of an archived transaction')
+            wallet.balance = balance
+            wallet.save()
+
+    return results
+
+
+def replay(wallet_id, amount, transaction):
+    if not settings.WALLET_IDEMPOTENT_TRANSACTIONS:
+        metrics.TXID_CONFLICTS.labels('rejected').inc()
+        return ValidationError({'txid': [TXID_EXISTS_ERROR]})
+
+    if transaction.wallet_id != wallet_id or transaction.amount != amount:
+        metrics.TXID_CONFLICTS.labels('rejected').inc()
+        return TransactionConflict()
+
+    metrics.TXID_CONFLICTS.labels('replayed').inc()
+    return transaction, True
+
+
+class PendingCreate:
+    def __init__(self, txid, amount):
+        self.txid = txid
+        self.amount = amount
+        self.future = Future()
+
+
+class GroupCommitQueue:
+    def __init__(self, window, max_batch_size, workers, max_pending=None):
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='group-commit')
+        self.lock = threading.Lock()
+        # Wallet id to creates waiting for a batch. A wallet is present while its drain is scheduled or running
+        self.queues = {}
+
+    def submit(self, wallet_id, txid, amount):
+        item = PendingCreate(txid, amount)
+        with self.lock:
+            queue = self.queues.get(wallet_id)
+            start_drain = queue is None
+            if start_drain:
+                queue = self.queues[wallet_id] = []
+            elif self.max_pending and len(queue) >= self.max_pending:
+                raise WalletBusy()
+            queue.append(item)
+
+        if start_drain:
+            # The first batch fills up during the window without holding a worker, the following batches are collected
+            # while the previous one commits
+            timer = threading.Timer(self.window, self.executor.submit, [self.drain, wallet_id])
+            timer.daemon = True
+            timer.start()
+        return item.future
+
+    def drain(self, wallet_id):
+        with self.lock:
+            queue = self.queues[wallet_id]
+            batch, queue[:] = queue[:self.max_batch_size], queue[self.max_batch_size:]
+
+        # Creates whose requests timed out are cancelled and skipped
+        batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+        if batch:
+            self.write(wallet_id, batch)
+
+        with self.lock:
+            if not self.queues[wallet_id]:
+                del self.queues[wallet_id]
+                return
+        # One batch per turn: the next batch of this wallet waits behind batches of other wallets, so a wallet that
+        # keeps its queue full can't hold a worker while creates of other wallets wait
+        self.executor.submit(self.drain, wallet_id)
+
+    def write(self, wallet_id, batch):
+        try:
+            results = write_batch(wallet_id, [(item.txid, item.amount) for item in batch])
+        except IntegrityError:
+            # A txid was taken by a concurrent write outside of this batch, retrying creates one by one
+            if len(batch) > 1:
+                for item in batch:
+                    self.write(wallet_id, [item])
+            else:
+                metrics.TXID_CONFLICTS.labels('rejected').inc()
+                batch[0].future.set_exception(ValidationError({'txid': [TXID_EXISTS_ERROR]}))
+            return
+        except Exception as exc:
+            results = [exc] * len(batch)
+        finally:
+            close_old_connections()
+
+        for item, result in zip(batch, results):
+            if isinstance(result, Exception):
+                item.future.set_exception(result)
+            else:
+                item.future.set_result(result)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    # Created lazily, so every gunicorn worker process gets its own worker threads
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = GroupCommitQueue(window=settings.WALLET_GROUP_COMMIT_WINDOW_MS / 1000,
+                                      max_batch_size=settings.WALLET_GROUP_COMMIT_MAX_BATCH_SIZE,
+                                      workers=settings.WALLET_GROUP_COMMIT_WORKERS,
+                                      max_pending=settings.WALLET_GROUP_COMMIT_MAX_PENDING)
+    return _queue
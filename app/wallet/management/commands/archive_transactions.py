@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.wallet.archive import archive_batch
+
+
+class Command(BaseCommand):
+    help = 'Moves old transactions to the archive table and updates wallet checkpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.WALLET_ARCHIVE_AFTER_DAYS,
+                            help='Archive transactions created more than this number of days ago.')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Number of transactions moved per database transaction.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+
+        archived = 0
+        while moved := archive_batch(cutoff, options['batch_size']):
+            archived += moved
+            self.stdout.write(f'Archived {archived} transactions')
+
+        self.stdout.write(self.style.SUCCESS(f'{archived} transactions created before {cutoff} archived'))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db import transaction as db_transaction
+
+from app.wallet import partitioning
+
+
+class Command(BaseCommand):
+    help = 'Creates monthly partitions of the transactions table ahead of time. Intended to run from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=settings.WALLET_TRANSACTION_PARTITIONS_AHEAD,
+                            help='Number of months after the current one to create partitions for.')
+
+    def handle(self, *args, **options):
+        if not partitioning.is_enabled(connection):
+            raise CommandError('The transactions table is not partitioned, run migrations on postgres with '
+                               'WALLET_PARTITION_TRANSACTIONS=true.')
+
+        with db_transaction.atomic(), connection.cursor() as cursor:
+            created = partitioning.create_partitions(cursor, options['months_ahead'])
+
+        for name in created:
+            self.stdout.write(f'Created partition {name}')
+        self.stdout.write(self.style.SUCCESS(f'{len(created)} partitions created'))
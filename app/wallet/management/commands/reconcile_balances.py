@@ -0,0 +1,92 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from app.wallet.models import ReconciliationRun
+from app.wallet.reconciliation import reconcile_range, uuid_ranges
+
+
+class Command(BaseCommand):
+    help = ('Checks that wallet balances equal the sum of their transactions and archive checkpoints. '
+            'By default only wallets updated since the last finished run and unresolved mismatches are checked.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='Number of worker processes, 1 runs in the current process.')
+        parser.add_argument('--ranges', type=int,
+                            help='Number of wallet id ranges to split the work into, 4 per process by default.')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Number of wallets checked by one aggregate query.')
+        parser.add_argument('--full', action='store_true', help='Check all wallets.')
+        parser.add_argument('--since', type=datetime.fromisoformat,
+                            help='Check wallets updated since this ISO 8601 moment instead of the last run.')
+        parser.add_argument('--margin', type=int, default=300,
+                            help='Seconds subtracted from the last run start, at least the longest write transaction.')
+        parser.add_argument('--repair', action='store_true',
+                            help='Set mismatched balances to the sum of their ledger.')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError('--processes must be at least 1')
+
+        since = None if options['full'] else options['since'] or self.get_watermark(options['margin'])
+        run = ReconciliationRun.objects.create(started_at=timezone.now(),
+                                               full=since is None,
+                                               repair=options['repair'])
+        if since is None:
+            self.stdout.write('Checking all wallets')
+        else:
+            self.stdout.write(f'Checking wallets updated since {since.isoformat()}')
+
+        ranges = uuid_ranges(options['ranges'] or options['processes'] * 4)
+        kwargs = {'since': since, 'chunk_size': options['chunk_size'], 'repair': options['repair']}
+        started = time.perf_counter()
+
+        if options['processes'] == 1:
+            results = [reconcile_range(lower, upper, **kwargs) for lower, upper in ranges]
+        else:
+            results = self.run_in_processes(ranges, kwargs, options['processes'])
+
+        elapsed = time.perf_counter() - started
+        for field in ('wallets_checked', 'mismatches', 'repaired'):
+            setattr(run, field, sum(result[field] for result in results))
+        run.finished_at = timezone.now()
+        run.save()
+
+        for result in results:
+            for wallet_id, balance, expected in result['reported']:
+                self.stdout.write(self.style.WARNING(f'Wallet {wallet_id}: balance {balance}, ledger {expected}'))
+
+        throughput = run.wallets_checked / elapsed if elapsed else 0
+        summary = (f'Checked {run.wallets_checked} wallets in {elapsed:.1f}s ({throughput:.0f} wallets/s), '
+                   f'{run.mismatches} mismatches, {run.repaired} repaired')
+        self.stdout.write(self.style.ERROR(summary) if run.mismatches > run.repaired else self.style.SUCCESS(summary))
+
+    def get_watermark(self, margin):
+        # Start of the last finished run, wallets changed while it was running are checked again. updated_at is set
+        # before the write commits, a write still open when the last run read the wallet has updated_at up to its
+        # duration before the run start, hence the margin. Mismatches it didn't repair are checked again too, see
+        # WalletMismatch
+        last_run = ReconciliationRun.objects.filter(finished_at__isnull=False).first()
+        return last_run.started_at - timedelta(seconds=margin) if last_run else None
+
+    def run_in_processes(self, ranges, kwargs, processes):
+        # Workers open their own connections, this one would only sit idle until they are done
+        connections.close_all()
+
+        results = []
+        # Spawned workers set up django and open their own DB connection
+        with ProcessPoolExecutor(max_workers=processes, mp_context=get_context('spawn'),
+                                 initializer=django.setup) as executor:
+            futures = [executor.submit(reconcile_range, lower, upper, **kwargs) for lower, upper in ranges]
+            for number, future in enumerate(as_completed(futures), start=1):
+                results.append(future.result())
+                self.stdout.write(f'{number}/{len(ranges)} ranges done')
+        return results
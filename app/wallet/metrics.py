@@ -0,0 +1,69 @@
+"""
+Prometheus metrics of the wallet API.
+
+When the app runs in several gunicorn worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty directory
+shared by the workers. Every worker then writes its values there and /metrics aggregates them (see gunicorn.conf.py).
+"""
+import os
+import time
+
+from django.db import connection
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+REQUEST_LATENCY = Histogram('wallet_request_duration_seconds', 'Request latency by route name.',
+                            ['route', 'method', 'status'])
+REQUEST_DB_QUERIES = Histogram('wallet_request_db_queries', 'Number of DB queries per request by route name.',
+                               ['route'], buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50, 100))
+REQUEST_DB_TIME = Histogram('wallet_request_db_duration_seconds', 'Time spent in DB queries per request by route name.',
+                            ['route'])
+LOCK_WAIT = Histogram('wallet_lock_wait_seconds', 'Time spent waiting for the wallet row lock.', ['operation'],
+                      buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+INSUFFICIENT_BALANCE = Counter('wallet_insufficient_balance_total',
+                               'Transactions rejected because of insufficient wallet balance.', ['operation'])
+TXID_CONFLICTS = Counter('wallet_txid_conflicts_total',
+                         'Transaction creates with an already used txid, by result (rejected or replayed).',
+                         ['result'])
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        started = time.perf_counter()
+        with connection.execute_wrapper(stats):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        route = request.resolver_match.url_name if request.resolver_match else 'unmatched'
+        if route != 'metrics':
+            REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(duration)
+            REQUEST_DB_QUERIES.labels(route).observe(stats.count)
+            REQUEST_DB_TIME.labels(route).observe(stats.duration)
+        return response
+
+
+def metrics_view(request):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
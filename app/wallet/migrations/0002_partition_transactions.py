@@ -0,0 +1,192 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:05
+
+from datetime import date, datetime, timezone
+
+from django.conf import settings
+from django.db import migrations, models
+
+from app.wallet.partitioning import forget_detected
+
+# The schema below is frozen with this migration, changes to it need a new migration
+
+CREATE_PARTITIONED_TABLE_SQL = """
+ALTER TABLE transactions RENAME TO transactions_unpartitioned;
+ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey;
+
+CREATE TABLE transactions (
+    id uuid NOT NULL,
+    wallet_id uuid NOT NULL REFERENCES wallets (id) DEFERRABLE INITIALLY DEFERRED,
+    txid varchar(64) NOT NULL,
+    amount numeric(33, 18) NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    updated_at timestamp with time zone NOT NULL,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX transactions_wallet_id_idx ON transactions (wallet_id);
+CREATE INDEX transactions_txid_idx ON transactions (txid);
+CREATE INDEX transactions_amount_idx ON transactions (amount);
+CREATE INDEX transactions_created_at_idx ON transactions (created_at);
+
+CREATE TABLE transactions_default PARTITION OF transactions DEFAULT;
+
+CREATE TABLE transaction_txids (
+    txid varchar(64) PRIMARY KEY,
+    transaction_id uuid NOT NULL,
+    created_at timestamp with time zone NOT NULL
+);
+"""
+
+CREATE_PARTITION_SQL = """
+CREATE TABLE {name} PARTITION OF transactions FOR VALUES FROM (%s) TO (%s)
+"""
+
+COPY_UNPARTITIONED_SQL = """
+INSERT INTO transactions (id, wallet_id, txid, amount, created_at, updated_at)
+SELECT id, wallet_id, txid, amount, created_at, updated_at FROM transactions_unpartitioned;
+
+INSERT INTO transaction_txids (txid, transaction_id, created_at)
+SELECT txid, id, created_at FROM transactions_unpartitioned;
+
+DROP TABLE transactions_unpartitioned;
+"""
+
+# A txid claimed beforehand by the same transaction (see TransactionManager.create_if_absent) is not a conflict.
+# Row triggers don't fire on TRUNCATE, e.g. the flush between Django's TransactionTestCase tests
+CREATE_TXIDS_TRIGGERS_SQL = """
+CREATE FUNCTION transaction_txids_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM transaction_txids WHERE txid = OLD.txid AND transaction_id = OLD.id;
+        RETURN OLD;
+    END IF;
+
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.txid = OLD.txid AND NEW.created_at = OLD.created_at THEN
+            RETURN NEW;
+        END IF;
+        DELETE FROM transaction_txids WHERE txid = OLD.txid AND transaction_id = OLD.id;
+    END IF;
+
+    INSERT INTO transaction_txids (txid, transaction_id, created_at)
+    VALUES (NEW.txid, NEW.id, NEW.created_at)
+    ON CONFLICT (txid) DO NOTHING;
+
+    IF NOT FOUND AND NOT EXISTS (
+        SELECT 1 FROM transaction_txids WHERE txid = NEW.txid AND transaction_id = NEW.id
+    ) THEN
+        RAISE unique_violation
+            USING MESSAGE = 'duplicate key value violates unique constraint "transaction_txids_pkey"',
+                  DETAIL = format('Key (txid)=(%s) already exists.', NEW.txid);
+    END IF;
+
+    RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER transaction_txids_sync
+AFTER INSERT OR UPDATE OR DELETE ON transactions
+FOR EACH ROW EXECUTE FUNCTION transaction_txids_sync();
+
+CREATE FUNCTION transaction_txids_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE transaction_txids;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER transaction_txids_truncate
+AFTER TRUNCATE ON transactions
+FOR EACH STATEMENT EXECUTE FUNCTION transaction_txids_truncate();
+"""
+
+DROP_PARTITIONED_TABLE_SQL = """
+CREATE TABLE transactions_unpartitioned (LIKE transactions INCLUDING DEFAULTS);
+INSERT INTO transactions_unpartitioned SELECT * FROM transactions;
+
+DROP TABLE transactions;
+DROP TABLE transaction_txids;
+DROP FUNCTION transaction_txids_sync();
+DROP FUNCTION transaction_txids_truncate();
+
+-- Names of the indexes created by the initial migration, so the table can be partitioned again
+ALTER TABLE transactions_unpartitioned RENAME TO transactions;
+ALTER TABLE transactions
+    ADD PRIMARY KEY (id),
+    ADD UNIQUE (txid),
+    ADD CONSTRAINT transactions_wallet_id_ce705075_fk_wallets_id
+        FOREIGN KEY (wallet_id) REFERENCES wallets (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX transactions_wallet_id_ce705075 ON transactions (wallet_id);
+CREATE INDEX transactions_amount_9a398af6 ON transactions (amount);
+CREATE INDEX transactions_txid_6dfb24d3_like ON transactions (txid varchar_pattern_ops);
+"""
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_table(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(CREATE_PARTITIONED_TABLE_SQL)
+        cursor.execute('SELECT min(created_at) FROM transactions_unpartitioned')
+        oldest = cursor.fetchone()[0]
+
+        # Monthly partitions from the oldest transaction up to WALLET_TRANSACTION_PARTITIONS_AHEAD months ahead
+        today = datetime.now(tz=timezone.utc).date()
+        month = date((oldest or today).year, (oldest or today).month, 1)
+        last = date(today.year, today.month, 1)
+        for _ in range(settings.WALLET_TRANSACTION_PARTITIONS_AHEAD):
+            last = next_month(last)
+        while month <= last:
+            bounds = [datetime(value.year, value.month, 1, tzinfo=timezone.utc) for value in (month, next_month(month))]
+            cursor.execute(CREATE_PARTITION_SQL.format(name=f'transactions_p{month:%Y%m}'), bounds)
+            month = next_month(month)
+
+        cursor.execute(COPY_UNPARTITIONED_SQL)
+        cursor.execute(CREATE_TXIDS_TRIGGERS_SQL)
+    forget_detected(schema_editor.connection)
+
+
+def unpartition_table(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(DROP_PARTITIONED_TABLE_SQL)
+    forget_detected(schema_editor.connection)
+
+
+def partition_transactions(apps, schema_editor):
+    if settings.WALLET_PARTITION_TRANSACTIONS and schema_editor.connection.vendor == 'postgresql':
+        partition_table(schema_editor)
+
+
+def unpartition_transactions(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('transactions'))")
+        partitioned = cursor.fetchone()[0]
+    if partitioned:
+        unpartition_table(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionTxid',
+            fields=[
+                ('txid', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('transaction_id', models.UUIDField()),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'transaction_txids',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(partition_transactions, unpartition_transactions),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-19 15:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0002_partition_transactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletCheckpoint',
+            fields=[
+                ('wallet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='checkpoint', serialize=False, to='wallet.wallet')),
+                ('amount', models.DecimalField(decimal_places=18, default=0, max_digits=33)),
+                ('transactions_count', models.BigIntegerField(default=0)),
+                ('archived_until', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'wallet_checkpoints',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('txid', models.CharField(max_length=64, unique=True)),
+                ('amount', models.DecimalField(decimal_places=18, max_digits=33)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_transactions', to='wallet.wallet')),
+            ],
+            options={
+                'db_table': 'transactions_archive',
+                'ordering': ['-created_at', 'id'],
+            },
+        ),
+    ]
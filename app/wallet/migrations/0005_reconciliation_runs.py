@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-19 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0004_wallet_label_trigram_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('full', models.BooleanField()),
+                ('repair', models.BooleanField()),
+                ('wallets_checked', models.BigIntegerField(default=0)),
+                ('mismatches', models.BigIntegerField(default=0)),
+                ('repaired', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'reconciliation_runs',
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
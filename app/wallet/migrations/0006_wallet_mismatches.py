@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-19 18:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0005_reconciliation_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletMismatch',
+            fields=[
+                ('wallet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='mismatch', serialize=False, to='wallet.wallet')),
+                ('balance', models.DecimalField(decimal_places=18, max_digits=33)),
+                ('expected', models.DecimalField(decimal_places=18, max_digits=33)),
+                ('found_at', models.DateTimeField(auto_now_add=True)),
+                ('checked_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'wallet_mismatches',
+            },
+        ),
+    ]
@@ -1,6 +1,12 @@
 from uuid import uuid4
 
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import connections, models
+from django.db.models import Subquery
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+from app.wallet import partitioning
 
 
 # About indexes:
@@ -24,6 +30,74 @@ class Wallet(models.Model):
     class Meta:
         db_table = 'wallets'
         ordering = ['-created_at', 'id']
+        indexes = [
+            # Trigram index for label search. Case insensitive lookups compare UPPER(label), so the index does too
+            GinIndex(OpClass(Upper('label'), name='gin_trgm_ops'), name='wallets_label_trgm'),
+            # Incremental reconciliation reads wallets updated since the last run
+            models.Index(fields=['updated_at'], name='wallets_updated_at_idx'),
+        ]
+
+
+class TransactionTxid(models.Model):
+    # Keeps txid globally unique when transactions are partitioned, maintained by a trigger (see partitioning.py)
+    txid = models.CharField(max_length=64, primary_key=True)
+    transaction_id = models.UUIDField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'transaction_txids'
+
+
+class TransactionManager(models.Manager):
+    def filter_txid(self, txid):
+        queryset = self.filter(txid=txid)
+        if partitioning.is_enabled(connections[self.db]):
+            # Partition key from the txid lookup table lets postgres scan a single partition
+            created_at = TransactionTxid.objects.using(self.db).filter(txid=txid).values('created_at')[:1]
+            queryset = queryset.filter(created_at=Subquery(created_at))
+        return queryset
+
+    def create_if_absent(self, wallet, txid, amount):
+        """
+        Inserts a transaction with INSERT ... ON CONFLICT (txid) DO NOTHING RETURNING.
+        Returns the created transaction or None if the txid is already taken.
+        """
+        now = timezone.now()
+        transaction = self.model(wallet=wallet, txid=txid, amount=amount, created_at=now, updated_at=now)
+        connection = connections[self.db]
+
+        if partitioning.is_enabled(connection):
+            # No unique index on txid in a partitioned table, the txid is claimed in the lookup table instead
+            with connection.cursor() as cursor:
+                cursor.execute(f'INSERT INTO {TransactionTxid._meta.db_table} (txid, transaction_id, created_at) '
+                               f'VALUES (%s, %s, %s) ON CONFLICT (txid) DO NOTHING RETURNING txid',
+                               [txid, transaction.id, now])
+                if cursor.fetchone() is None:
+                    return None
+            inserted = self._insert(connection, transaction)
+        else:
+            inserted = self._insert(connection, transaction, on_conflict='ON CONFLICT (txid) DO NOTHING')
+
+        if not inserted:
+            return None
+
+        transaction._state.adding = False
+        transaction._state.db = self.db
+        return transaction
+
+    def _insert(self, connection, transaction, on_conflict=''):
+        qn = connection.ops.quote_name
+        fields = [self.model._meta.get_field(name)
+                  for name in ('id', 'wallet', 'txid', 'amount', 'created_at', 'updated_at')]
+        columns = ', '.join(qn(field.column) for field in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        params = [field.get_db_prep_save(getattr(transaction, field.attname), connection) for field in fields]
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {qn(self.model._meta.db_table)} ({columns}) VALUES ({placeholders}) '
+                           f'{on_conflict} RETURNING {qn("id")}', params)
+            return cursor.fetchone() is not None
 
 
 class Transaction(models.Model):
@@ -35,6 +109,68 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TransactionManager()
+
     class Meta:
         db_table = 'transactions'
         ordering = ['-created_at', 'id']
+
+
+class ArchivedTransaction(models.Model):
+    # Transactions moved out of the transactions table by the archive_transactions command, read only.
+    # Only the indexes needed for lookups by id and txid are kept
+    id = models.UUIDField(primary_key=True)  # noqa: A003
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='archived_transactions')
+    txid = models.CharField(max_length=64, unique=True)
+    amount = models.DecimalField(decimal_places=18, max_digits=33)
+
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'transactions_archive'
+        ordering = ['-created_at', 'id']
+
+
+class WalletCheckpoint(models.Model):
+    # Sum of archived transactions of a wallet. Wallet balance equals amount plus the sum of its live transactions
+    wallet = models.OneToOneField(Wallet, on_delete=models.CASCADE, primary_key=True, related_name='checkpoint')
+    amount = models.DecimalField(decimal_places=18, max_digits=33, default=0)
+    transactions_count = models.BigIntegerField(default=0)
+    # Every transaction of the wallet created before this moment is archived
+    archived_until = models.DateTimeField()
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'wallet_checkpoints'
+
+
+class ReconciliationRun(models.Model):
+    # A run of the reconcile_balances command. Incremental runs check wallets updated since the last finished run
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True)
+    full = models.BooleanField()
+    repair = models.BooleanField()
+    wallets_checked = models.BigIntegerField(default=0)
+    mismatches = models.BigIntegerField(default=0)
+    repaired = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'reconciliation_runs'
+        ordering = ['-started_at']
+
+
+class WalletMismatch(models.Model):
+    # Balance mismatch found by reconcile_balances and not repaired. Incremental runs check these wallets again until
+    # they match, their updated_at doesn't have to change for that
+    wallet = models.OneToOneField(Wallet, on_delete=models.CASCADE, primary_key=True, related_name='mismatch')
+    balance = models.DecimalField(decimal_places=18, max_digits=33)
+    expected = models.DecimalField(decimal_places=18, max_digits=33)
+
+    found_at = models.DateTimeField(auto_now_add=True)
+    checked_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'wallet_mismatches'
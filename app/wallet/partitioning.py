@@ -0,0 +1,103 @@
+"""
+Optional range partitioning of the transactions table by created_at.
+
+Postgres can't enforce uniqueness of txid on a partitioned table, because the partition key is not part of it.
+The transaction_txids table keeps txids globally unique and is maintained by a trigger on transactions.
+It also stores created_at of every transaction, so a lookup by txid can be pruned to a single partition.
+
+WALLET_PARTITION_TRANSACTIONS only decides whether migrations partition the table. At runtime the code follows the
+actual schema, which is read from the catalog once per process. The migration that (un)partitions the table resets it,
+other processes have to be restarted.
+"""
+from datetime import date, datetime, timezone
+
+from django.db import connection as default_connection
+
+TABLE = 'transactions'
+DEFAULT_PARTITION = 'transactions_default'
+TXIDS_TABLE = 'transaction_txids'
+
+# (connection alias, database name) to whether its transactions table is partitioned
+_detected = {}
+
+
+def is_enabled(connection=None):
+    """Whether the transactions table is partitioned, read from the catalog once per process and database."""
+    connection = connection or default_connection
+    if connection.vendor != 'postgresql':
+        return False
+
+    key = (connection.alias, connection.settings_dict['NAME'])
+    partitioned = _detected.get(key)
+    if partitioned is None:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))',
+                           [TABLE])
+            partitioned = _detected[key] = cursor.fetchone()[0]
+    return partitioned
+
+
+def forget_detected(connection):
+    """Makes the next is_enabled() read the catalog again, needed after the table is (un)partitioned."""
+    _detected.pop((connection.alias, connection.settings_dict['NAME']), None)
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def month_datetime(month):
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y%m}'
+
+
+def create_partition(cursor, month):
+    """
+    Creates the monthly partition starting at `month` unless it exists.
+    Rows that already landed in the default partition for that month are moved into the new partition.
+    Returns True if the partition was created.
+    """
+    name = partition_name(month)
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+    if cursor.fetchone()[0]:
+        return False
+
+    lower, upper = month_datetime(month), month_datetime(add_months(month, 1))
+
+    cursor.execute(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)')
+    cursor.execute(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, [lower, upper])
+    cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', [lower, upper])
+    # The delete from the default partition fired the txids trigger, the moved rows have to be registered again
+    cursor.execute(f"""
+        INSERT INTO {TXIDS_TABLE} (txid, transaction_id, created_at)
+        SELECT txid, id, created_at FROM {name}
+        ON CONFLICT (txid) DO NOTHING
+    """)
+    return True
+
+
+def create_partitions(cursor, months_ahead, since=None):
+    """Creates monthly partitions from `since` (current month by default) up to `months_ahead` months ahead."""
+    today = datetime.now(tz=timezone.utc).date()
+    month = month_start(since or today)
+    last = add_months(month_start(today), months_ahead)
+
+    created = []
+    while month <= last:
+        if create_partition(cursor, month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
@@ -0,0 +1,114 @@
+"""
+Reconciliation of wallet balances with their ledgers.
+
+A wallet balance must equal the sum of its live transactions plus its archive checkpoint. Wallets are split into
+id ranges, every range is checked in chunks ordered by id with one aggregate query per chunk. A chunk is read from
+a single snapshot, so concurrent writes don't show up as mismatches. Mismatches that are not repaired are kept in
+WalletMismatch until a later run finds the wallet matching.
+"""
+from decimal import Decimal
+from uuid import UUID
+
+from django.db import connection
+from django.db import transaction as db_transaction
+from django.db.models import Q, Sum
+
+from app.wallet.archive import balance_at
+from app.wallet.models import Transaction, Wallet, WalletCheckpoint, WalletMismatch
+
+UUID_SPACE = 2 ** 128
+# Mismatches listed per range in the result, all of them are counted
+MAX_REPORTED_MISMATCHES = 100
+
+
+def uuid_ranges(parts):
+    """Splits the UUID space into `parts` [lower, upper) ranges, upper is None for the last range."""
+    bounds = [UUID(int=UUID_SPACE * part // parts) for part in range(parts)]
+    return list(zip(bounds, [*bounds[1:], None]))
+
+
+def reconcile_range(lower, upper, since=None, chunk_size=5000, repair=False):
+    """
+    Checks wallets with ids in [lower, upper) updated since `since` or left mismatched by a previous run, optionally
+    repairing their balances.
+    """
+    wallets = Wallet.objects.filter(id__gte=lower).order_by('id')
+    if upper is not None:
+        wallets = wallets.filter(id__lt=upper)
+    if since is not None:
+        wallets = wallets.filter(Q(updated_at__gte=since) | Q(id__in=WalletMismatch.objects.values('wallet_id')))
+
+    result = {'wallets_checked': 0, 'mismatches': 0, 'repaired': 0, 'reported': []}
+    last_id = None
+    while True:
+        chunk = wallets if last_id is None else wallets.filter(id__gt=last_id)
+        mismatches, chunk_ids = check_chunk(chunk, chunk_size)
+        if not chunk_ids:
+            break
+        last_id = max(chunk_ids)
+
+        result['wallets_checked'] += len(chunk_ids)
+        result['mismatches'] += len(mismatches)
+        unrepaired = []
+        for wallet_id, balance, expected in mismatches:
+            if not repair:
+                unrepaired.append(WalletMismatch(wallet_id=wallet_id, balance=balance, expected=expected))
+            elif repair_wallet(wallet_id):
+                result['repaired'] += 1
+            if len(result['reported']) < MAX_REPORTED_MISMATCHES:
+                result['reported'].append((str(wallet_id), str(balance), str(expected)))
+        record_mismatches(chunk_ids, unrepaired)
+
+    return result
+
+
+def record_mismatches(checked_ids, unrepaired):
+    """Replaces recorded mismatches of the checked wallets with the ones found unrepaired now."""
+    (WalletMismatch.objects
+     .filter(wallet_id__in=checked_ids)
+     .exclude(wallet_id__in=[mismatch.wallet_id for mismatch in unrepaired])
+     .delete())
+    WalletMismatch.objects.bulk_create(unrepaired, update_conflicts=True, unique_fields=['wallet'],
+                                       update_fields=['balance', 'expected', 'checked_at'])
+
+
+def check_chunk(wallets, chunk_size):
+    """Returns mismatches among the next `chunk_size` wallets as (id, balance, expected) and ids of the checked ones."""
+    # The isolation level can only be set by the first statement of a transaction. Inside an outer transaction, e.g.
+    # in tests, the chunk is read with the isolation level of that transaction
+    snapshot = connection.vendor == 'postgresql' and not connection.in_atomic_block
+    with db_transaction.atomic():
+        if snapshot:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+
+        balances = dict(wallets.values_list('id', 'balance')[:chunk_size])
+        if not balances:
+            return [], []
+
+        expected = dict(Transaction.objects
+                        .filter(wallet_id__in=balances)
+                        .order_by()
+                        .values('wallet_id')
+                        .annotate(total=Sum('amount'))
+                        .values_list('wallet_id', 'total'))
+        for wallet_id, amount in WalletCheckpoint.objects.filter(wallet_id__in=balances).values_list('wallet_id',
+                                                                                                     'amount'):
+            expected[wallet_id] = expected.get(wallet_id, Decimal('0')) + amount
+
+    mismatches = [(wallet_id, balance, expected.get(wallet_id, Decimal('0')))
+                  for wallet_id, balance in balances.items()
+                  if balance != expected.get(wallet_id, Decimal('0'))]
+    return mismatches, list(balances)
+
+
+def repair_wallet(wallet_id):
+    """Sets the wallet balance to its ledger sum, computed under the wallet lock. Returns True if it was changed."""
+    with db_transaction.atomic():
+        wallet = Wallet.objects.select_for_update().get(id=wallet_id)
+        expected = balance_at(wallet_id)
+        if wallet.balance == expected:
+            return False
+        wallet.balance = expected
+        wallet.save()
+    return True
@@ -1,10 +1,19 @@
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from decimal import Decimal
 
+from django.conf import settings
 from django.db import transaction as db_transaction
-from rest_framework.exceptions import ValidationError
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.validators import UniqueValidator
 from rest_framework_json_api import serializers
 
-from app.wallet.models import Transaction, Wallet
+from app.wallet import group_commit, metrics
+from app.wallet.admission import admit_write
+from app.wallet.archive import archived_txids
+from app.wallet.exceptions import TXID_EXISTS_ERROR, TransactionConflict, WalletLockTimeout, insufficient_balance_error
+from app.wallet.models import ArchivedTransaction, Transaction, Wallet
 
 
 class WalletSerializer(serializers.ModelSerializer):
@@ -24,6 +33,33 @@ class TransactionSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    # Set by create() when an idempotent create matched an already stored transaction
+    replayed = False
+
+    @property
+    def is_idempotent_create(self):
+        return self.instance is None and settings.WALLET_IDEMPOTENT_TRANSACTIONS
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.is_idempotent_create:
+            # Replays are resolved by the insert itself, the unique validator would reject them upfront
+            fields['txid'].validators = [validator for validator in fields['txid'].validators
+                                         if not isinstance(validator, UniqueValidator)]
+        else:
+            # Archived transactions keep their txid
+            fields['txid'].validators.append(UniqueValidator(queryset=ArchivedTransaction.objects.all(),
+                                                             message=TXID_EXISTS_ERROR))
+        return fields
+
+    def to_internal_value(self, data):
+        try:
+            return super().to_internal_value(data)
+        except ValidationError as exc:
+            if any(error.code == 'unique' for error in exc.detail.get('txid', [])):
+                metrics.TXID_CONFLICTS.labels('rejected').inc()
+            raise
+
     def validate(self, attrs):
         wallet = attrs.get('wallet') or self.instance.wallet
         new_amount = attrs.get('amount', self.instance.amount if self.instance else Decimal('0'))
@@ -32,33 +68,114 @@ class TransactionSerializer(serializers.ModelSerializer):
         if new_amount == Decimal('0'):
             raise ValidationError('Transaction amount cannot be zero.')
 
+        # Idempotent create checks the balance together with the balance update, a replay must not fail here
+        if self.is_idempotent_create:
+            return attrs
+
         balance_change = new_amount - previous_amount
 
         if (wallet.balance + balance_change) < 0:
-            raise ValidationError('Insufficient wallet balance. Wallet balance cannot be negative.')
+            raise insufficient_balance_error('create' if self.instance is None else 'update')
 
         return attrs
 
     def create(self, validated_data):
-        with db_transaction.atomic():
+        if settings.WALLET_GROUP_COMMIT:
+            return self.create_grouped(validated_data)
+
+        if settings.WALLET_IDEMPOTENT_TRANSACTIONS:
+            return self.create_idempotent(validated_data)
+
+        with db_transaction.atomic(), admit_write(validated_data['wallet'].id):
             # Using select for update to avoid race conditions when there is more than one replica of the application
-            wallet = Wallet.objects.select_for_update().get(id=validated_data['wallet'].id)
+            with metrics.LOCK_WAIT.labels('create').time():
+                wallet = Wallet.objects.select_for_update().get(id=validated_data['wallet'].id)
 
             transaction = Transaction.objects.create(
                 wallet=wallet,
                 txid=validated_data['txid'],
                 amount=validated_data['amount']
             )
+            if archived_txids([transaction.txid]):
+                # Archived by a run that committed after the unique validator
+                metrics.TXID_CONFLICTS.labels('rejected').inc()
+                raise ValidationError({'txid': [TXID_EXISTS_ERROR]})
 
             wallet.balance += transaction.amount
             wallet.save()
 
         return transaction
 
-    def update(self, instance, validated_data):
+    def create_grouped(self, validated_data):
+        # Blocks until the batch with this transaction is committed
+        future = group_commit.get_queue().submit(validated_data['wallet'].id,
+                                                 validated_data['txid'],
+                                                 validated_data['amount'])
+        try:
+            transaction, self.replayed = future.result(timeout=settings.WALLET_GROUP_COMMIT_TIMEOUT_MS / 1000)
+        except FuturesTimeoutError:
+            if future.cancel():
+                raise WalletLockTimeout()
+            # Already taken into a batch, waiting for its write
+            transaction, self.replayed = future.result()
+        return transaction
+
+    def create_idempotent(self, validated_data):
+        wallet = validated_data['wallet']
+        amount = validated_data['amount']
+
+        archived = ArchivedTransaction.objects.filter(txid=validated_data['txid']).first()
+        if archived is not None:
+            return self.get_replayed(validated_data, archived)
+
         with db_transaction.atomic():
+            transaction = Transaction.objects.create_if_absent(wallet=wallet,
+                                                               txid=validated_data['txid'],
+                                                               amount=amount)
+            if transaction is None:
+                return self.get_replayed(validated_data)
+            # Archived by a run that committed after the check above, see archived_txids()
+            archived = ArchivedTransaction.objects.filter(txid=transaction.txid).first()
+            if archived is not None:
+                db_transaction.set_rollback(True)
+                return self.get_replayed(validated_data, archived)
+
+            # Only a new transaction takes a write slot, replays above don't write to the wallet
+            with admit_write(wallet.id):
+                # Conditional update instead of select for update: the balance check and the update are one
+                # statement, so the wallet row is locked once and only by the update. The wallet foreign key is
+                # deferred, the insert above takes no lock on the wallet row before commit
+                with metrics.LOCK_WAIT.labels('create').time():
+                    updated = (Wallet.objects
+                               .filter(id=wallet.id, balance__gte=-amount)
+                               .update(balance=F('balance') + amount, updated_at=timezone.now()))
+                if not updated:
+                    raise insufficient_balance_error('create')
+
+        return transaction
+
+    def get_replayed(self, validated_data, transaction=None):
+        # The stored transaction may have been archived since the conflicting insert
+        transaction = (transaction or
+                       Transaction.objects.filter_txid(validated_data['txid']).first() or
+                       ArchivedTransaction.objects.get(txid=validated_data['txid']))
+        if transaction.wallet_id != validated_data['wallet'].id or transaction.amount != validated_data['amount']:
+            metrics.TXID_CONFLICTS.labels('rejected').inc()
+            raise TransactionConflict()
+
+        metrics.TXID_CONFLICTS.labels('replayed').inc()
+        self.replayed = True
+        return transaction
+
+    def update(self, instance, validated_data):
+        with db_transaction.atomic(), admit_write(instance.wallet.id):
             # Using select for update to avoid race conditions when there is more than one replica of the application
-            wallet = Wallet.objects.select_for_update().get(id=instance.wallet.id)
+            with metrics.LOCK_WAIT.labels('update').time():
+                wallet = Wallet.objects.select_for_update().get(id=instance.wallet.id)
+                # The transaction may have been archived since it was read, archiving skips locked transactions
+                instance = Transaction.objects.select_for_update().filter(id=instance.id).first()
+            if instance is None:
+                raise NotFound()
 
             previous_amount = instance.amount
             new_amount = validated_data.get('amount', previous_amount)
@@ -68,9 +185,12 @@ class TransactionSerializer(serializers.ModelSerializer):
                 raise ValidationError('Transaction amount cannot be zero.')
 
             if (wallet.balance + amount_change) < 0:
-                raise ValidationError('Insufficient wallet balance. Wallet balance cannot be negative.')
+                raise insufficient_balance_error('update')
 
-            instance = super().update(instance, validated_data)
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            # Never falls back to an insert, which would bring back a transaction deleted by archiving
+            instance.save(force_update=True)
 
             wallet.balance += amount_change
             wallet.save()
@@ -0,0 +1,41 @@
+from django.urls import reverse
+from rest_framework import status
+
+
+class WalletApiMixin:
+    # Creates wallets and transactions through the API, shared by the API test cases
+    def create_wallet(self, label='Test Wallet'):
+        url = reverse('wallet-list')
+        payload = {
+            'data': {
+                'type': 'Wallet',
+                'attributes': {
+                    'label': label
+                }
+            }
+        }
+        response = self.client.post(url, payload, format='vnd.api+json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+
+    def create_transaction(self, wallet_id, txid, amount, client=None):
+        # Pass a client of its own when calling from another thread
+        url = reverse('transaction-list')
+        payload = {
+            'data': {
+                'type': 'Transaction',
+                'attributes': {
+                    'txid': txid,
+                    'amount': str(amount)
+                },
+                'relationships': {
+                    'wallet': {
+                        'data': {
+                            'type': 'Wallet',
+                            'id': wallet_id
+                        }
+                    }
+                }
+            }
+        }
+        return (client or self.client).post(url, payload, format='vnd.api+json')
@@ -0,0 +1,174 @@
+import threading
+import time
+from decimal import Decimal
+from unittest import skipUnless
+
+from django.db import connection
+from django.db import transaction as db_transaction
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APIClient, APITransactionTestCase
+
+from app.wallet.admission import admit_write
+from app.wallet.models import Wallet
+from app.wallet.tests import WalletApiMixin
+
+
+@override_settings(WALLET_WRITE_CONCURRENCY=2, WALLET_WRITE_RETRY_AFTER=3)
+class WalletAdmissionTests(WalletApiMixin, APITransactionTestCase):
+    def hold_write_slots(self, wallet_id, slots):
+        """Occupies write slots of the wallet from other threads, like writes stuck behind a hot wallet lock."""
+        admitted = threading.Barrier(slots + 1)
+        release = threading.Event()
+
+        def hold():
+            try:
+                with db_transaction.atomic(), admit_write(wallet_id):
+                    admitted.wait()
+                    release.wait()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=hold) for _ in range(slots)]
+        for thread in threads:
+            thread.start()
+        admitted.wait()
+
+        def stop():
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.addCleanup(stop)
+
+    def test_hot_wallet_writes_rejected_when_slots_taken(self):
+        wallet_id = self.create_wallet('Hot Wallet')['id']
+        self.hold_write_slots(Wallet.objects.get(id=wallet_id).id, 2)
+
+        started = time.perf_counter()
+        for number in range(10):
+            response = self.create_transaction(wallet_id, f'tx_hot_{number}', Decimal('10'))
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '3')
+        # Rejected without waiting for the wallet lock
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertEqual(Wallet.objects.get(id=wallet_id).balance, Decimal('0'))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Needs row level locks')
+    @override_settings(WALLET_LOCK_TIMEOUT_MS=30000)
+    def test_unrelated_wallet_not_affected_by_hot_wallet_storm(self):
+        hot_wallet_id = self.create_wallet('Hot Wallet')['id']
+        cold_wallet_id = self.create_wallet('Cold Wallet')['id']
+
+        # A slow write holds the hot wallet row lock, the admitted hot writers queue behind it in select_for_update
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            try:
+                with db_transaction.atomic():
+                    Wallet.objects.select_for_update().get(id=hot_wallet_id)
+                    locked.set()
+                    release.wait()
+            finally:
+                connection.close()
+
+        responses = []
+
+        def write_hot(number):
+            try:
+                responses.append(self.create_transaction(hot_wallet_id, f'tx_hot_{number}', Decimal('10'),
+                                                         client=APIClient()))
+            finally:
+                connection.close()
+
+        lock_holder = threading.Thread(target=hold_lock)
+        lock_holder.start()
+        locked.wait()
+        writers = [threading.Thread(target=write_hot, args=(number,)) for number in range(8)]
+        for writer in writers:
+            writer.start()
+        self.addCleanup(release.set)
+
+        self.assertTrue(self.wait_for_lock_waiters(2))
+        latencies = []
+        for number in range(10):
+            started = time.perf_counter()
+            response = self.create_transaction(cold_wallet_id, f'tx_cold_{number}', Decimal('10'))
+            latencies.append(time.perf_counter() - started)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # Measured while the admitted hot writers were still blocked on the wallet lock
+        self.assertEqual(self.lock_waiters(), 2)
+        self.assertLess(max(latencies), 0.5)
+
+        release.set()
+        lock_holder.join()
+        for writer in writers:
+            writer.join()
+
+        self.assertEqual(sorted(response.status_code for response in responses),
+                         [status.HTTP_201_CREATED] * 2 + [status.HTTP_429_TOO_MANY_REQUESTS] * 6)
+        self.assertEqual(Wallet.objects.get(id=hot_wallet_id).balance, Decimal('20'))
+        self.assertEqual(Wallet.objects.get(id=cold_wallet_id).balance, Decimal('100'))
+
+    def lock_waiters(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_stat_activity "
+                           "WHERE datname = current_database() AND wait_event_type = 'Lock'")
+            return cursor.fetchone()[0]
+
+    def wait_for_lock_waiters(self, count, timeout=5):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if self.lock_waiters() == count:
+                return True
+            time.sleep(0.05)
+        return False
+
+    @override_settings(WALLET_IDEMPOTENT_TRANSACTIONS=True)
+    def test_replay_admitted_when_slots_taken(self):
+        wallet_id = self.create_wallet()['id']
+        self.assertEqual(self.create_transaction(wallet_id, 'tx_replayed', Decimal('10')).status_code,
+                         status.HTTP_201_CREATED)
+        self.hold_write_slots(Wallet.objects.get(id=wallet_id).id, 2)
+
+        response = self.create_transaction(wallet_id, 'tx_replayed', Decimal('10'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.create_transaction(wallet_id, 'tx_new', Decimal('10'))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(Wallet.objects.get(id=wallet_id).balance, Decimal('10'))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Needs row level locks')
+    @override_settings(WALLET_LOCK_TIMEOUT_MS=100)
+    def test_lock_wait_bounded_by_timeout(self):
+        wallet_id = self.create_wallet()['id']
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            try:
+                with db_transaction.atomic():
+                    Wallet.objects.select_for_update().get(id=wallet_id)
+                    locked.set()
+                    release.wait()
+            finally:
+                connection.close()
+
+        lock_holder = threading.Thread(target=hold_lock)
+        lock_holder.start()
+        locked.wait()
+        try:
+            response = self.create_transaction(wallet_id, 'tx_timed_out', Decimal('10'))
+        finally:
+            release.set()
+            lock_holder.join()
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_write_admitted_below_limit(self):
+        wallet_id = self.create_wallet()['id']
+        self.hold_write_slots(Wallet.objects.get(id=wallet_id).id, 1)
+
+        response = self.create_transaction(wallet_id, 'tx_admitted', Decimal('10'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -0,0 +1,138 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.db import transaction as db_transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from app.wallet.archive import archive_batch, balance_at
+from app.wallet.models import ArchivedTransaction, Transaction, Wallet, WalletCheckpoint
+from app.wallet.serializers import TransactionSerializer
+from app.wallet.tests import WalletApiMixin
+
+
+class ArchiveTransactionsTests(WalletApiMixin, APITestCase):
+    def setUp(self):
+        self.wallet_id = self.create_wallet()['id']
+        for txid, amount in [('tx_old1', 100), ('tx_old2', -30), ('tx_new', 5)]:
+            response = self.create_transaction(self.wallet_id, txid, Decimal(amount))
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.old_moment = datetime.now(tz=timezone.utc) - timedelta(days=200)
+        Transaction.objects.filter(txid='tx_old1').update(created_at=self.old_moment)
+        Transaction.objects.filter(txid='tx_old2').update(created_at=self.old_moment + timedelta(days=1))
+
+        call_command('archive_transactions', older_than_days=90, stdout=StringIO())
+
+    def test_archive_moves_old_transactions_and_records_checkpoint(self):
+        self.assertEqual(list(Transaction.objects.values_list('txid', flat=True)), ['tx_new'])
+        self.assertEqual(ArchivedTransaction.objects.count(), 2)
+
+        checkpoint = WalletCheckpoint.objects.get(wallet_id=self.wallet_id)
+        self.assertEqual(checkpoint.amount, Decimal('70'))
+        self.assertEqual(checkpoint.transactions_count, 2)
+
+    def test_balance_at(self):
+        self.assertEqual(balance_at(self.wallet_id), Wallet.objects.get(id=self.wallet_id).balance)
+        self.assertEqual(balance_at(self.wallet_id), Decimal('75'))
+        self.assertEqual(balance_at(self.wallet_id, self.old_moment), Decimal('100'))
+        self.assertEqual(balance_at(self.wallet_id, self.old_moment - timedelta(days=1)), Decimal('0'))
+
+    def test_get_archived_transaction_by_txid_and_id(self):
+        archived = ArchivedTransaction.objects.get(txid='tx_old1')
+
+        response = self.client.get(reverse('transaction-detail-by-txid', kwargs={'txid': 'tx_old1'}),
+                                   format='vnd.api+json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], str(archived.id))
+        self.assertEqual(response.data['amount'], '100.000000000000000000')
+
+        response = self.client.get(reverse('transaction-detail', kwargs={'pk': archived.id}), format='vnd.api+json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['txid'], 'tx_old1')
+
+    def test_create_transaction_with_archived_txid_error(self):
+        response = self.create_transaction(self.wallet_id, 'tx_old1', Decimal('100'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(WALLET_IDEMPOTENT_TRANSACTIONS=True)
+    def test_replay_archived_transaction(self):
+        response = self.create_transaction(self.wallet_id, 'tx_old1', Decimal('100'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Wallet.objects.get(id=self.wallet_id).balance, Decimal('75'))
+
+    def test_update_of_transaction_archived_after_read(self):
+        archived = ArchivedTransaction.objects.get(txid='tx_old1')
+        # Read by the update request before the archive run moved it
+        stale = Transaction(id=archived.id, wallet_id=archived.wallet_id, txid=archived.txid, amount=archived.amount,
+                            created_at=archived.created_at, updated_at=archived.updated_at)
+
+        serializer = TransactionSerializer(stale, data={'amount': '150'}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.assertRaises(NotFound):
+            serializer.save()
+
+        self.assertFalse(Transaction.objects.filter(txid='tx_old1').exists())
+        self.assertEqual(Wallet.objects.get(id=self.wallet_id).balance, Decimal('75'))
+        self.assertEqual(balance_at(self.wallet_id), Decimal('75'))
+
+
+class ArchiveBatchTests(TestCase):
+    def test_archive_nothing(self):
+        call_command('archive_transactions', stdout=StringIO())
+        self.assertFalse(ArchivedTransaction.objects.exists())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Needs concurrent transactions')
+@override_settings(WALLET_IDEMPOTENT_TRANSACTIONS=True)
+class ArchiveConcurrencyTests(WalletApiMixin, APITransactionTestCase):
+    def test_replay_while_transaction_is_archived(self):
+        wallet_id = self.create_wallet()['id']
+        self.assertEqual(self.create_transaction(wallet_id, 'tx_racing', Decimal('100')).status_code,
+                         status.HTTP_201_CREATED)
+        Transaction.objects.filter(txid='tx_racing').update(created_at=datetime.now(tz=timezone.utc) - timedelta(days=200))
+
+        archived = threading.Event()
+        commit = threading.Event()
+
+        def archive():
+            try:
+                with db_transaction.atomic():
+                    archive_batch(datetime.now(tz=timezone.utc) - timedelta(days=90), 100)
+                    archived.set()
+                    commit.wait()
+            finally:
+                connection.close()
+
+        responses = []
+
+        def replay():
+            try:
+                responses.append(self.create_transaction(wallet_id, 'tx_racing', Decimal('100'), client=APIClient()))
+            finally:
+                connection.close()
+
+        archiver = threading.Thread(target=archive)
+        archiver.start()
+        archived.wait()
+        # The replay doesn't see the uncommitted archive row and its insert waits for the archive run
+        replayer = threading.Thread(target=replay)
+        replayer.start()
+        time.sleep(0.5)
+        commit.set()
+        archiver.join()
+        replayer.join()
+
+        self.assertEqual(responses[0].status_code, status.HTTP_200_OK)
+        self.assertFalse(Transaction.objects.filter(txid='tx_racing').exists())
+        self.assertEqual(ArchivedTransaction.objects.filter(txid='tx_racing').count(), 1)
+        self.assertEqual(Wallet.objects.get(id=wallet_id).balance, Decimal('100'))
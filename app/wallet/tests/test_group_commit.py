@@ -0,0 +1,191 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient, APITransactionTestCase
+
+from app.wallet import group_commit
+from app.wallet.exceptions import TransactionConflict
+from app.wallet.group_commit import GroupCommitQueue, write_batch
+from app.wallet.models import Transaction, Wallet
+from app.wallet.tests import WalletApiMixin
+
+
+class WriteBatchTests(TestCase):
+    def setUp(self):
+        self.wallet = Wallet.objects.create(label='Test Wallet')
+
+    def test_balance_checked_in_order(self):
+        results = write_batch(self.wallet.id, [('tx1', Decimal('100')),
+                                               ('tx2', Decimal('-50')),
+                                               ('tx3', Decimal('-80')),
+                                               ('tx4', Decimal('30'))])
+
+        self.assertEqual([result[0].txid for result in results if not isinstance(result, Exception)],
+                         ['tx1', 'tx2', 'tx4'])
+        self.assertIsInstance(results[2], ValidationError)
+        self.assertIn('Insufficient wallet balance', str(results[2]))
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('80'))
+        self.assertEqual(sorted(Transaction.objects.values_list('txid', flat=True)), ['tx1', 'tx2', 'tx4'])
+
+    def test_duplicate_txid_rejected(self):
+        write_batch(self.wallet.id, [('tx1', Decimal('100'))])
+        results = write_batch(self.wallet.id, [('tx1', Decimal('100')), ('tx2', Decimal('10')), ('tx2', Decimal('10'))])
+
+        self.assertIsInstance(results[0], ValidationError)
+        self.assertEqual(results[1][0].txid, 'tx2')
+        self.assertIsInstance(results[2], ValidationError)
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('110'))
+
+    @override_settings(WALLET_IDEMPOTENT_TRANSACTIONS=True)
+    def test_duplicate_txid_replayed(self):
+        first, = write_batch(self.wallet.id, [('tx1', Decimal('100'))])
+        results = write_batch(self.wallet.id, [('tx1', Decimal('100')), ('tx1', Decimal('50'))])
+
+        self.assertEqual(results[0], (first[0], True))
+        self.assertIsInstance(results[1], TransactionConflict)
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100'))
+
+
+class RecordingQueue(GroupCommitQueue):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = []
+
+    def write(self, wallet_id, batch):
+        self.batches.append((wallet_id, [item.txid for item in batch]))
+        for item in batch:
+            item.future.set_result((item.txid, False))
+
+
+class SlowRecordingQueue(RecordingQueue):
+    def write(self, wallet_id, batch):
+        # Every batch takes a while to commit
+        time.sleep(0.02)
+        super().write(wallet_id, batch)
+
+
+class GroupCommitQueueTests(SimpleTestCase):
+    def test_creates_coalesced_per_wallet(self):
+        queue = RecordingQueue(window=0.05, max_batch_size=3, workers=2)
+
+        with ThreadPoolExecutor(max_workers=8) as clients:
+            futures = [clients.submit(queue.submit, wallet_id, f'{wallet_id}-{number}', Decimal('1'))
+                       for wallet_id in ('a', 'b') for number in range(4)]
+            results = [future.result().result(timeout=5) for future in futures]
+
+        self.assertEqual(len(results), 8)
+        self.assertEqual(sorted(len(batch) for wallet_id, batch in queue.batches if wallet_id == 'a'), [1, 3])
+        self.assertEqual(sorted(len(batch) for wallet_id, batch in queue.batches if wallet_id == 'b'), [1, 3])
+        self.assertEqual(queue.queues, {})
+
+    def test_wallets_take_turns(self):
+        queue = SlowRecordingQueue(window=0.05, max_batch_size=1, workers=1)
+
+        futures = [queue.submit('hot', f'hot-{number}', Decimal('1')) for number in range(3)]
+        # The cold wallet's window ends while the first hot batch commits
+        time.sleep(0.01)
+        futures.append(queue.submit('cold', 'cold-0', Decimal('1')))
+        for future in futures:
+            future.result(timeout=5)
+
+        # The cold wallet is written after one batch of the hot wallet, not after all of them
+        self.assertEqual(queue.batches, [('hot', ['hot-0']), ('cold', ['cold-0']),
+                                         ('hot', ['hot-1']), ('hot', ['hot-2'])])
+        self.assertEqual(queue.queues, {})
+
+    def test_cancelled_create_skipped(self):
+        queue = RecordingQueue(window=0.05, max_batch_size=3, workers=1)
+
+        cancelled = queue.submit('a', 'a-0', Decimal('1'))
+        written = queue.submit('a', 'a-1', Decimal('1'))
+        self.assertTrue(cancelled.cancel())
+
+        self.assertEqual(written.result(timeout=5), ('a-1', False))
+        self.assertEqual(queue.batches, [('a', ['a-1'])])
+
+
+@override_settings(WALLET_GROUP_COMMIT=True, WALLET_GROUP_COMMIT_WINDOW_MS=20)
+class GroupCommitApiTests(WalletApiMixin, APITransactionTestCase):
+    def setUp(self):
+        # Every test gets a queue created with its settings
+        group_commit._queue = None
+        self.addCleanup(self.stop_queue)
+
+    def stop_queue(self):
+        if group_commit._queue is not None:
+            group_commit._queue.executor.shutdown(wait=True)
+            group_commit._queue = None
+
+    @override_settings(WALLET_IDEMPOTENT_TRANSACTIONS=True)
+    def test_create_replay_and_errors(self):
+        wallet_id = self.create_wallet()['id']
+
+        response = self.create_transaction(wallet_id, 'tx1', Decimal('100'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['txid'], 'tx1')
+
+        response = self.create_transaction(wallet_id, 'tx1', Decimal('100'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['amount'], '100.000000000000000000')
+
+        # Errors raised by the worker thread reach the response
+        self.assertEqual(self.create_transaction(wallet_id, 'tx1', Decimal('50')).status_code,
+                         status.HTTP_409_CONFLICT)
+        response = self.create_transaction(wallet_id, 'tx2', Decimal('-500'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Insufficient wallet balance', str(response.data))
+
+        self.assertEqual(Wallet.objects.get(id=wallet_id).balance, Decimal('100'))
+
+    @skipUnless(connection.vendor == 'postgresql', 'The shared cache sqlite test database locks tables across threads')
+    def test_concurrent_creates_batched(self):
+        wallet_id = self.create_wallet()['id']
+        responses = []
+
+        def create(number):
+            try:
+                responses.append(self.create_transaction(wallet_id, f'tx_concurrent_{number}', Decimal('10'),
+                                                         client=APIClient()))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=create, args=(number,)) for number in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_201_CREATED] * 10)
+        self.assertEqual(Wallet.objects.get(id=wallet_id).balance, Decimal('100'))
+        self.assertEqual(Transaction.objects.filter(wallet_id=wallet_id).count(), 10)
+
+    @override_settings(WALLET_GROUP_COMMIT_WORKERS=1, WALLET_GROUP_COMMIT_TIMEOUT_MS=100, WALLET_WRITE_RETRY_AFTER=2)
+    def test_create_not_written_in_time(self):
+        wallet_id = self.create_wallet()['id']
+        # Occupying the only worker, like batches of other wallets
+        release = threading.Event()
+        group_commit.get_queue().executor.submit(release.wait)
+        self.addCleanup(release.set)
+
+        response = self.create_transaction(wallet_id, 'tx_late', Decimal('10'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '2')
+
+        release.set()
+        self.assertEqual(self.create_transaction(wallet_id, 'tx_in_time', Decimal('10')).status_code,
+                         status.HTTP_201_CREATED)
+        self.assertFalse(Transaction.objects.filter(txid='tx_late').exists())
+        self.assertEqual(Wallet.objects.get(id=wallet_id).balance, Decimal('10'))
@@ -0,0 +1,52 @@
+from decimal import Decimal
+
+from django.urls import reverse
+from prometheus_client import REGISTRY
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from app.wallet.tests import WalletApiMixin
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTests(WalletApiMixin, APITestCase):
+    def test_request_and_lock_wait_metrics(self):
+        requests_before = sample('wallet_request_duration_seconds_count',
+                                 route='transaction-list', method='POST', status='201')
+        lock_waits_before = sample('wallet_lock_wait_seconds_count', operation='create')
+        queries_before = sample('wallet_request_db_queries_sum', route='transaction-list')
+
+        wallet_id = self.create_wallet()['id']
+        response = self.create_transaction(wallet_id, 'tx_metrics', Decimal('10'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(sample('wallet_request_duration_seconds_count',
+                                route='transaction-list', method='POST', status='201'), requests_before + 1)
+        self.assertEqual(sample('wallet_lock_wait_seconds_count', operation='create'), lock_waits_before + 1)
+        self.assertGreater(sample('wallet_request_db_queries_sum', route='transaction-list'), queries_before)
+
+    def test_rejection_counters(self):
+        insufficient_before = sample('wallet_insufficient_balance_total', operation='create')
+        conflicts_before = sample('wallet_txid_conflicts_total', result='rejected')
+
+        wallet_id = self.create_wallet()['id']
+        self.assertEqual(self.create_transaction(wallet_id, 'tx_metrics_overdraw', Decimal('-10')).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.create_transaction(wallet_id, 'tx_metrics_dup', Decimal('10')).status_code,
+                         status.HTTP_201_CREATED)
+        self.assertEqual(self.create_transaction(wallet_id, 'tx_metrics_dup', Decimal('10')).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(sample('wallet_insufficient_balance_total', operation='create'), insufficient_before + 1)
+        self.assertEqual(sample('wallet_txid_conflicts_total', result='rejected'), conflicts_before + 1)
+
+    def test_metrics_endpoint(self):
+        self.create_wallet()
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'wallet_request_duration_seconds_bucket{', response.content)
+        self.assertIn(b'route="wallet-list"', response.content)
@@ -0,0 +1,111 @@
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db import transaction as db_transaction
+from django.test import SimpleTestCase, TestCase
+
+from app.wallet import partitioning
+from app.wallet.models import Transaction, TransactionTxid, Wallet
+
+partition_migration = import_module('app.wallet.migrations.0002_partition_transactions')
+
+
+class MonthArithmeticTests(SimpleTestCase):
+    def test_month_start(self):
+        self.assertEqual(partitioning.month_start(date(2026, 10, 19)), date(2026, 10, 1))
+        self.assertEqual(partitioning.month_start(datetime(2026, 1, 31, 23, 59, tzinfo=timezone.utc)),
+                         date(2026, 1, 1))
+
+    def test_add_months(self):
+        self.assertEqual(partitioning.add_months(date(2026, 10, 1), 1), date(2026, 11, 1))
+        self.assertEqual(partitioning.add_months(date(2026, 10, 1), 3), date(2027, 1, 1))
+        self.assertEqual(partitioning.add_months(date(2026, 12, 1), 1), date(2027, 1, 1))
+        self.assertEqual(partitioning.add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(partitioning.add_months(date(2026, 1, 1), 25), date(2028, 2, 1))
+
+    def test_partition_name(self):
+        self.assertEqual(partitioning.partition_name(date(2026, 1, 1)), 'transactions_p202601')
+        self.assertEqual(partitioning.partition_name(date(2026, 12, 1)), 'transactions_p202612')
+
+    def test_month_datetime(self):
+        self.assertEqual(partitioning.month_datetime(date(2026, 2, 1)), datetime(2026, 2, 1, tzinfo=timezone.utc))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Partitioning is postgres only')
+class PartitionedTransactionsTests(TestCase):
+    def setUp(self):
+        # DDL is transactional in postgres, the test rollback restores the unpartitioned table
+        if not partitioning.is_enabled(connection):
+            with connection.schema_editor() as schema_editor:
+                partition_migration.partition_table(schema_editor)
+            self.addCleanup(partitioning.forget_detected, connection)
+
+        self.wallet = Wallet.objects.create(label='Partitioned', balance=Decimal('0'))
+        self.old_moment = datetime.now(tz=timezone.utc) - timedelta(days=800)
+
+    def partition_of(self, transaction):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM transactions WHERE id = %s', [transaction.id])
+            return cursor.fetchone()[0]
+
+    def test_detected_from_schema(self):
+        self.assertTrue(partitioning.is_enabled(connection))
+        with self.assertNumQueries(0):
+            self.assertTrue(partitioning.is_enabled(connection))
+
+    def test_duplicate_txid_across_partitions(self):
+        transaction = Transaction.objects.create(wallet=self.wallet, txid='tx_dup', amount=Decimal('10'))
+        Transaction.objects.filter(id=transaction.id).update(created_at=self.old_moment)
+        self.assertEqual(self.partition_of(transaction), partitioning.DEFAULT_PARTITION)
+
+        with self.assertRaises(IntegrityError), db_transaction.atomic():
+            Transaction.objects.create(wallet=self.wallet, txid='tx_dup', amount=Decimal('10'))
+
+        self.assertIsNone(Transaction.objects.create_if_absent(self.wallet, 'tx_dup', Decimal('10')))
+        self.assertEqual(Transaction.objects.filter(txid='tx_dup').count(), 1)
+
+    def test_truncate_clears_txids(self):
+        Transaction.objects.create(wallet=self.wallet, txid='tx_truncated', amount=Decimal('10'))
+        with connection.cursor() as cursor:
+            # The wallet foreign key is deferred, TRUNCATE refuses to run with its checks pending
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute('TRUNCATE transactions')
+
+        self.assertFalse(TransactionTxid.objects.exists())
+        Transaction.objects.create(wallet=self.wallet, txid='tx_truncated', amount=Decimal('10'))
+
+    def test_txid_lookup_after_created_at_change(self):
+        transaction = Transaction.objects.create(wallet=self.wallet, txid='tx_moved', amount=Decimal('10'))
+        Transaction.objects.filter(id=transaction.id).update(created_at=self.old_moment)
+
+        self.assertEqual(Transaction.objects.filter_txid('tx_moved').get().id, transaction.id)
+        self.assertEqual(TransactionTxid.objects.get(txid='tx_moved').created_at, self.old_moment)
+
+    def test_create_partition_moves_rows_from_default_partition(self):
+        transaction = Transaction.objects.create(wallet=self.wallet, txid='tx_default', amount=Decimal('10'))
+        Transaction.objects.filter(id=transaction.id).update(created_at=self.old_moment)
+
+        month = partitioning.month_start(self.old_moment)
+        with connection.cursor() as cursor:
+            self.assertTrue(partitioning.create_partition(cursor, month))
+            self.assertFalse(partitioning.create_partition(cursor, month))
+
+        self.assertEqual(self.partition_of(transaction), partitioning.partition_name(month))
+        self.assertEqual(Transaction.objects.filter_txid('tx_default').get().id, transaction.id)
+        self.assertEqual(TransactionTxid.objects.get(txid='tx_default').transaction_id, transaction.id)
+
+    def test_create_transaction_partitions_command(self):
+        last = partitioning.add_months(partitioning.month_start(datetime.now(tz=timezone.utc)), 12)
+
+        output = StringIO()
+        call_command('create_transaction_partitions', months_ahead=12, stdout=output)
+
+        self.assertIn(f'Created partition {partitioning.partition_name(last)}', output.getvalue())
+        output = StringIO()
+        call_command('create_transaction_partitions', months_ahead=12, stdout=output)
+        self.assertIn('0 partitions created', output.getvalue())
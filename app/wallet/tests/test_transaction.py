@@ -1,47 +1,17 @@
+from datetime import datetime, timezone
 from decimal import Decimal
 from uuid import uuid4
 
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from app.wallet.models import Transaction
+from app.wallet.tests import WalletApiMixin
 
-class WalletTransactionTests(APITestCase):
-    def create_wallet(self, label='Test Wallet'):
-        url = reverse('wallet-list')
-        payload = {
-            'data': {
-                'type': 'Wallet',
-                'attributes': {
-                    'label': label
-                }
-            }
-        }
-        response = self.client.post(url, payload, format='vnd.api+json')
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        return response.data
-
-    def create_transaction(self, wallet_id, txid, amount):
-        url = reverse('transaction-list')
-        payload = {
-            'data': {
-                'type': 'Transaction',
-                'attributes': {
-                    'txid': txid,
-                    'amount': str(amount)
-                },
-                'relationships': {
-                    'wallet': {
-                        'data': {
-                            'type': 'Wallet',
-                            'id': wallet_id
-                        }
-                    }
-                }
-            }
-        }
-        return self.client.post(url, payload, format='vnd.api+json')
 
+class WalletTransactionTests(WalletApiMixin, APITestCase):
     def test_create_and_update_transaction_ok(self):
         wallet_data = self.create_wallet()
         wallet_id = wallet_data['id']
@@ -277,3 +247,71 @@ class WalletTransactionTests(APITestCase):
         expected_page2_amounts = [Decimal(str(i * 10)) for i in range(11, 16)]
         for item, expected in zip(data2, expected_page2_amounts):
             self.assertEqual(Decimal(item['amount']), expected)
+
+    def test_list_transactions_created_range(self):
+        wallet_id = self.create_wallet()['id']
+        for txid in ['tx_old', 'tx_mid', 'tx_new']:
+            self.assertEqual(self.create_transaction(wallet_id, txid, Decimal('10')).status_code,
+                             status.HTTP_201_CREATED)
+
+        Transaction.objects.filter(txid='tx_old').update(created_at=datetime(2024, 1, 15, tzinfo=timezone.utc))
+        Transaction.objects.filter(txid='tx_mid').update(created_at=datetime(2024, 2, 15, tzinfo=timezone.utc))
+
+        url = reverse('transaction-list')
+        params = '?filter[created_after]=2024-02-01T00:00:00Z&filter[created_before]=2024-03-01T00:00:00Z'
+        response = self.client.get(url + params, format='vnd.api+json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['txid'] for item in response.data['results']], ['tx_mid'])
+
+
+@override_settings(WALLET_IDEMPOTENT_TRANSACTIONS=True)
+class IdempotentTransactionTests(WalletTransactionTests):
+    def test_replay_returns_existing_transaction(self):
+        wallet_id = self.create_wallet()['id']
+
+        response1 = self.create_transaction(wallet_id, 'tx_replay', Decimal('100'))
+        self.assertEqual(response1.status_code, status.HTTP_201_CREATED)
+
+        response2 = self.create_transaction(wallet_id, 'tx_replay', Decimal('100'))
+        self.assertEqual(response2.status_code, status.HTTP_200_OK)
+        self.assertEqual(response2.data['id'], response1.data['id'])
+
+        wallet_detail = self.client.get(reverse('wallet-detail', kwargs={'pk': wallet_id}), format='vnd.api+json')
+        self.assertEqual(Decimal(wallet_detail.data['balance']), Decimal('100'))
+
+    def test_replay_with_different_amount_conflict(self):
+        wallet_id = self.create_wallet()['id']
+
+        response1 = self.create_transaction(wallet_id, 'tx_replay_amount', Decimal('100'))
+        self.assertEqual(response1.status_code, status.HTTP_201_CREATED)
+
+        response2 = self.create_transaction(wallet_id, 'tx_replay_amount', Decimal('50'))
+        self.assertEqual(response2.status_code, status.HTTP_409_CONFLICT)
+
+        wallet_detail = self.client.get(reverse('wallet-detail', kwargs={'pk': wallet_id}), format='vnd.api+json')
+        self.assertEqual(Decimal(wallet_detail.data['balance']), Decimal('100'))
+
+    def test_replay_with_different_wallet_conflict(self):
+        wallet_id = self.create_wallet()['id']
+        other_wallet_id = self.create_wallet('Other Wallet')['id']
+
+        response1 = self.create_transaction(wallet_id, 'tx_replay_wallet', Decimal('100'))
+        self.assertEqual(response1.status_code, status.HTTP_201_CREATED)
+
+        response2 = self.create_transaction(other_wallet_id, 'tx_replay_wallet', Decimal('100'))
+        self.assertEqual(response2.status_code, status.HTTP_409_CONFLICT)
+
+        wallet_detail = self.client.get(reverse('wallet-detail', kwargs={'pk': other_wallet_id}),
+                                        format='vnd.api+json')
+        self.assertEqual(Decimal(wallet_detail.data['balance']), Decimal('0'))
+
+    def test_insufficient_funds_does_not_store_transaction(self):
+        wallet_id = self.create_wallet()['id']
+
+        response = self.create_transaction(wallet_id, 'tx_overdraw_idempotent', Decimal('-10'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Insufficient wallet balance. Wallet balance cannot be negative.', str(response.data))
+
+        get_url = reverse('transaction-detail-by-txid', kwargs={'txid': 'tx_overdraw_idempotent'})
+        self.assertEqual(self.client.get(get_url, format='vnd.api+json').status_code, status.HTTP_404_NOT_FOUND)
@@ -1,5 +1,7 @@
+from unittest import skipUnless
 from uuid import uuid4
 
+from django.db import connection
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -96,3 +98,53 @@ class WalletTests(APITestCase):
         }
         response = self.client.put(url, payload, format='vnd.api+json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_search_wallets_by_label(self):
+        for label in ['Alice Savings', 'alice checking', 'Bob Savings', 'Malice']:
+            self.assertEqual(self.create_wallet(label).status_code, status.HTTP_201_CREATED)
+
+        url = reverse('wallet-list')
+        response = self.client.get(url + '?filter[search]=ALICE&sort=created_at', format='vnd.api+json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([wallet['label'] for wallet in response.data['results']],
+                         ['Alice Savings', 'alice checking', 'Malice'])
+
+        response = self.client.get(url + '?filter[search]=alice&filter[search_mode]=prefix&sort=created_at',
+                                   format='vnd.api+json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([wallet['label'] for wallet in response.data['results']],
+                         ['Alice Savings', 'alice checking'])
+
+    def test_search_wallets_with_balance_filter(self):
+        self.create_wallet('Alice Savings')
+        response = self.client.get(reverse('wallet-list') + '?filter[search]=alice&filter[min_balance]=10',
+                                   format='vnd.api+json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+    def test_search_wallets_invalid_mode(self):
+        response = self.client.get(reverse('wallet-list') + '?filter[search]=alice&filter[search_mode]=fuzzy',
+                                   format='vnd.api+json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('"fuzzy" is not a valid choice.', str(response.data))
+
+        response = self.client.get(reverse('wallet-list') + '?filter[search]=alice&filter[search_kind]=prefix',
+                                   format='vnd.api+json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Trigram similarity requires postgres')
+    def test_search_wallets_by_similarity(self):
+        for label in ['Alice Savings', 'Alise Savings', 'Bob Checking']:
+            self.create_wallet(label)
+
+        response = self.client.get(reverse('wallet-list') + '?filter[search]=Alice Savings&filter[search_mode]=similar',
+                                   format='vnd.api+json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([wallet['label'] for wallet in response.data['results']], ['Alice Savings', 'Alise Savings'])
+
+    @skipUnless(connection.vendor != 'postgresql', 'Similar search is rejected on other databases only')
+    def test_search_wallets_by_similarity_needs_postgres(self):
+        response = self.client.get(reverse('wallet-list') + '?filter[search]=alice&filter[search_mode]=similar',
+                                   format='vnd.api+json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('only available on postgres', str(response.data))
@@ -1,13 +1,20 @@
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models.functions import Upper
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from django_filters import NumberFilter, UUIDFilter
+from django_filters import IsoDateTimeFilter, NumberFilter, UUIDFilter
 from django_filters.rest_framework import FilterSet
-from rest_framework import mixins, viewsets
+from rest_framework import mixins, status, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import SearchFilter
+from rest_framework.response import Response
 from rest_framework_json_api.django_filters import DjangoFilterBackend
 from rest_framework_json_api.filters import OrderingFilter
 from rest_framework_json_api.pagination import JsonApiPageNumberPagination
 from rest_framework_json_api.parsers import JSONParser
 
-from app.wallet.models import Transaction, Wallet
+from app.wallet.models import ArchivedTransaction, Transaction, Wallet
 from app.wallet.serializers import TransactionSerializer, WalletSerializer
 
 
@@ -16,6 +23,59 @@ class Pagination(JsonApiPageNumberPagination):
     max_page_size = 100
 
 
+class UniqueOrderingFilter(OrderingFilter):
+    # Id as the last sort key makes the order total, so pages are stable and can be walked by keyset
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering and not {'id', '-id'} & set(ordering):
+            ordering = [*ordering, 'id']
+        return ordering
+
+
+SEARCH_MODE_SUBSTRING = 'substring'
+SEARCH_MODE_PREFIX = 'prefix'
+SEARCH_MODE_SIMILAR = 'similar'
+SEARCH_MODES = [SEARCH_MODE_SUBSTRING, SEARCH_MODE_PREFIX, SEARCH_MODE_SIMILAR]
+
+
+class LabelSearchFilter(SearchFilter):
+    """
+    Searches wallets by label with filter[search], using the trigram index on UPPER(label). Unlike SearchFilter it
+    doesn't read search_fields, only labels are searched.
+    filter[search_mode] is substring (default), prefix or similar. Similar mode orders wallets by trigram similarity
+    to the search term unless another sort is requested, it needs postgres and is rejected with 400 elsewhere.
+    """
+    search_mode_param = 'filter[search_mode]'
+
+    def filter_queryset(self, request, queryset, view):
+        mode = request.query_params.get(self.search_mode_param) or SEARCH_MODE_SUBSTRING
+        if mode not in SEARCH_MODES:
+            raise ValidationError({'search_mode': [f'"{mode}" is not a valid choice.']})
+
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+
+        if mode == SEARCH_MODE_PREFIX:
+            return queryset.filter(label__istartswith=term)
+        if mode == SEARCH_MODE_SIMILAR:
+            if connection.vendor != 'postgresql':
+                raise ValidationError({'search_mode': ['Similar search is only available on postgres.']})
+            return (queryset
+                    .annotate(label_upper=Upper('label'), similarity=TrigramSimilarity(Upper('label'), term.upper()))
+                    .filter(label_upper__trigram_similar=term.upper())
+                    .order_by('-similarity', 'id'))
+        return queryset.filter(label__icontains=term)
+
+
+class WalletFilterBackend(DjangoFilterBackend):
+    def get_filterset_kwargs(self, request, queryset, view):
+        # filter[search_mode] is read by LabelSearchFilter, it isn't an unknown filter
+        kwargs = super().get_filterset_kwargs(request, queryset, view)
+        kwargs['filter_keys'] = [key for key in kwargs['filter_keys'] if key != 'search_mode']
+        return kwargs
+
+
 class WalletFilter(FilterSet):
     min_balance = NumberFilter(field_name='balance', lookup_expr='gt')
     max_balance = NumberFilter(field_name='balance', lookup_expr='lt')
@@ -30,7 +90,7 @@ class WalletView(mixins.CreateModelMixin,
     serializer_class = WalletSerializer
     pagination_class = Pagination
     parser_classes = [JSONParser]
-    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filter_backends = [WalletFilterBackend, LabelSearchFilter, UniqueOrderingFilter]
     filterset_class = WalletFilter
     ordering_fields = ['balance', 'created_at']
 
@@ -39,10 +99,13 @@ class TransactionFilter(FilterSet):
     min_amount = NumberFilter(field_name='amount', lookup_expr='gt')
     max_amount = NumberFilter(field_name='amount', lookup_expr='lt')
     wallet = UUIDFilter(field_name='wallet__id')
+    # Range on the partition key, lets postgres prune partitions when transactions are partitioned
+    created_after = IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = IsoDateTimeFilter(field_name='created_at', lookup_expr='lt')
 
     class Meta:
         model = Transaction
-        fields = ['min_amount', 'max_amount', 'wallet']
+        fields = ['min_amount', 'max_amount', 'wallet', 'created_after', 'created_before']
 
 
 class TransactionView(mixins.CreateModelMixin,
@@ -58,11 +121,33 @@ class TransactionView(mixins.CreateModelMixin,
     filterset_class = TransactionFilter
     ordering_fields = ['amount', 'created_at']
 
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        # Idempotent replay of an already stored txid
+        status_code = status.HTTP_200_OK if serializer.replayed else status.HTTP_201_CREATED
+        return Response(serializer.data, status=status_code, headers=headers)
+
     def get_object(self):
+        try:
+            return self.get_live_object()
+        except Http404:
+            # Archived transactions are read only and served from the slower archive table
+            if self.action != 'retrieve':
+                raise
+
+        lookup = {'txid': self.kwargs['txid']} if 'txid' in self.kwargs else {'pk': self.kwargs['pk']}
+        obj = get_object_or_404(ArchivedTransaction, **lookup)
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    def get_live_object(self):
         # If URL has txid parameter, searching transaction by txid
         if 'txid' in self.kwargs:
             txid = self.kwargs['txid']
-            obj = get_object_or_404(Transaction, txid=txid)
+            obj = get_object_or_404(Transaction.objects.filter_txid(txid))
             self.check_object_permissions(self.request, obj)
             return obj
         return super().get_object()
@@ -0,0 +1,331 @@
+"""
+Load test of the wallet API.
+
+Seeds wallets and transactions straight into the database configured by DATABASE_URL, then drives a running
+server with a weighted mix of requests from concurrent workers and prints a JSON report with throughput and
+latency percentiles per operation.
+
+    python -m benchmarks.wallet_api --base-url http://localhost:8000 --wallets 1000 --transactions 100000 \
+        --concurrency 16 --duration 30 --output bench.json
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from urllib.parse import urlencode, urlsplit
+from uuid import uuid4
+
+DEFAULT_MIX = 'create_hot=20,create_cold=10,update=10,list_wallet=15,filter=10,wallets=10,txid=20,deep_page=5'
+JSON_API = 'application/vnd.api+json'
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, weight = item.split('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'Unknown operation {name}, expected one of {", ".join(OPERATIONS)}')
+        mix[name] = float(weight)
+    return mix
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--wallets', type=int, default=1000, help='Number of wallets to seed.')
+    parser.add_argument('--transactions', type=int, default=100000, help='Number of transactions to seed.')
+    parser.add_argument('--hot-wallets', type=int, default=5,
+                        help='Number of wallets receiving create_hot requests.')
+    parser.add_argument('--history-days', type=int, default=365,
+                        help='Seeded transactions are spread over this number of past days.')
+    parser.add_argument('--no-seed', action='store_true',
+                        help='Reuse wallets and transactions seeded by a previous run.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent client workers.')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to drive load for.')
+    parser.add_argument('--warmup', type=float, default=3, help='Seconds of load excluded from the report.')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'Weighted operations, default: {DEFAULT_MIX}')
+    parser.add_argument('--deep-page', type=int, default=500, help='Page number requested by deep_page.')
+    parser.add_argument('--random-seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    return parser.parse_args(argv)
+
+
+def setup_django():
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+    import django
+    django.setup()
+
+
+def seed(options, rnd):
+    from django.db import transaction as db_transaction
+    from django.db.models import Sum
+
+    from app.wallet.models import Transaction, Wallet
+
+    run = uuid4().hex[:8]
+    now = datetime.now(tz=timezone.utc)
+    wallets = [Wallet(label=f'bench-{run}-{number}') for number in range(options.wallets)]
+
+    with db_transaction.atomic():
+        Wallet.objects.bulk_create(wallets, batch_size=5000)
+
+        for start in range(0, options.transactions, 5000):
+            numbers = range(start, min(start + 5000, options.transactions))
+            batch = [Transaction(wallet=rnd.choice(wallets),
+                                 txid=f'bench-{run}-{number}',
+                                 amount=Decimal(rnd.randint(1, 10000)) / 100)
+                     for number in numbers]
+            Transaction.objects.bulk_create(batch)
+
+            # created_at is auto_now_add, spreading transactions over the history is done after the insert.
+            # Transactions are ordered by age, so a batch covers only a few days
+            days = defaultdict(list)
+            for number, transaction in zip(numbers, batch):
+                days[options.history_days - number * options.history_days // options.transactions].append(
+                    transaction.id)
+            for days_ago, ids in days.items():
+                moment = now - timedelta(days=days_ago)
+                Transaction.objects.filter(id__in=ids).update(created_at=moment, updated_at=moment)
+
+        for wallet_id, balance in (Transaction.objects
+                                   .filter(wallet__label__startswith=f'bench-{run}-')
+                                   .values_list('wallet_id')
+                                   .annotate(balance=Sum('amount'))):
+            Wallet.objects.filter(id=wallet_id).update(balance=balance)
+
+
+def load_fixtures(options):
+    from app.wallet.models import Transaction, Wallet
+
+    wallets = [str(wallet_id) for wallet_id in Wallet.objects.filter(label__startswith='bench-')
+               .order_by('id').values_list('id', flat=True)]
+    if not wallets:
+        raise SystemExit('No seeded wallets found, run without --no-seed first')
+
+    transactions = list(Transaction.objects
+                        .filter(txid__startswith='bench-')
+                        .order_by('?')
+                        .values_list('id', 'txid', 'wallet_id')[:10000])
+    return {
+        'wallets': wallets,
+        'hot_wallets': wallets[:options.hot_wallets],
+        'transactions': [(str(pk), txid, str(wallet_id)) for pk, txid, wallet_id in transactions],
+    }
+
+
+def transaction_payload(wallet_id, txid, amount, pk=None):
+    data = {
+        'type': 'Transaction',
+        'attributes': {'txid': txid, 'amount': str(amount)},
+        'relationships': {'wallet': {'data': {'type': 'Wallet', 'id': wallet_id}}},
+    }
+    if pk is not None:
+        data['id'] = pk
+    return {'data': data}
+
+
+def op_create(fixtures, rnd, options, wallets):
+    body = transaction_payload(rnd.choice(wallets), f'bench-load-{uuid4().hex}', Decimal(rnd.randint(1, 1000)))
+    return 'POST', '/api/transactions', body
+
+
+def op_create_hot(fixtures, rnd, options):
+    return op_create(fixtures, rnd, options, fixtures['hot_wallets'])
+
+
+def op_create_cold(fixtures, rnd, options):
+    return op_create(fixtures, rnd, options, fixtures['wallets'])
+
+
+def op_update(fixtures, rnd, options):
+    pk, txid, wallet_id = rnd.choice(fixtures['transactions'])
+    # Seeded amounts are positive, so a positive new amount never overdraws the wallet
+    body = transaction_payload(wallet_id, txid, Decimal(rnd.randint(1, 10000)) / 100, pk=pk)
+    return 'PUT', f'/api/transactions/{pk}', body
+
+
+def op_list_wallet(fixtures, rnd, options):
+    query = {'filter[wallet]': rnd.choice(fixtures['wallets']), 'sort': '-created_at'}
+    return 'GET', f'/api/transactions?{urlencode(query)}', None
+
+
+def op_filter(fixtures, rnd, options):
+    since = datetime.now(tz=timezone.utc) - timedelta(days=rnd.randint(1, options.history_days))
+    query = {'filter[min_amount]': rnd.randint(1, 50),
+             'filter[created_after]': since.isoformat(),
+             'filter[created_before]': (since + timedelta(days=7)).isoformat(),
+             'sort': '-amount'}
+    return 'GET', f'/api/transactions?{urlencode(query)}', None
+
+
+def op_wallets(fixtures, rnd, options):
+    query = {'filter[min_balance]': rnd.randint(0, 1000), 'sort': '-balance'}
+    return 'GET', f'/api/wallets?{urlencode(query)}', None
+
+
+def op_txid(fixtures, rnd, options):
+    _, txid, _ = rnd.choice(fixtures['transactions'])
+    return 'GET', f'/api/transactions/txid/{txid}', None
+
+
+def op_deep_page(fixtures, rnd, options):
+    query = {'page[number]': rnd.randint(options.deep_page // 2, options.deep_page), 'page[size]': 100}
+    return 'GET', f'/api/transactions?{urlencode(query)}', None
+
+
+OPERATIONS = {
+    'create_hot': op_create_hot,
+    'create_cold': op_create_cold,
+    'update': op_update,
+    'list_wallet': op_list_wallet,
+    'filter': op_filter,
+    'wallets': op_wallets,
+    'txid': op_txid,
+    'deep_page': op_deep_page,
+}
+
+
+class Worker(threading.Thread):
+    def __init__(self, number, options, fixtures, results, started, deadline):
+        super().__init__(daemon=True)
+        self.options = options
+        self.fixtures = fixtures
+        self.results = results
+        self.started = started
+        self.deadline = deadline
+        self.rnd = random.Random(options.random_seed + number)
+        self.names = list(options.mix)
+        self.weights = list(options.mix.values())
+
+    def connect(self):
+        url = urlsplit(self.options.base_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(url.hostname, url.port, timeout=60)
+
+    def run(self):
+        connection = self.connect()
+        while (now := time.perf_counter()) < self.deadline:
+            name = self.rnd.choices(self.names, self.weights)[0]
+            method, path, body = OPERATIONS[name](self.fixtures, self.rnd, self.options)
+            headers = {'Accept': JSON_API, 'Content-Type': JSON_API}
+
+            started = time.perf_counter()
+            try:
+                connection.request(method, path, body=json.dumps(body) if body else None, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = self.connect()
+                status = None
+            latency = time.perf_counter() - started
+
+            if now >= self.started:
+                self.results[name].append((latency, status))
+        connection.close()
+
+
+def percentile(values, percent):
+    # Nearest rank on sorted values. Integer percents keep the rank exact, 0.07 * 100 is 7.000000000000001 in floats
+    return values[max(0, math.ceil(percent * len(values) / 100) - 1)]
+
+
+def summarize(results, elapsed):
+    report = {}
+    for name, samples in sorted(results.items()):
+        latencies = sorted(latency * 1000 for latency, _ in samples)
+        errors = sum(1 for _, status in samples if status is None or status >= 400)
+        report[name] = {
+            'requests': len(samples),
+            'errors': errors,
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 3),
+                'p50': round(percentile(latencies, 50), 3),
+                'p95': round(percentile(latencies, 95), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'max': round(latencies[-1], 3),
+            },
+        }
+    return report
+
+
+def database_commits():
+    # Commits of all sessions, including the server's. Postgres flushes these stats about once a second
+    from django.db import connection
+
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT xact_commit FROM pg_stat_database WHERE datname = current_database()')
+        return cursor.fetchone()[0]
+
+
+def run_load(options, fixtures):
+    results = defaultdict(list)
+    now = time.perf_counter()
+    started = now + options.warmup
+    deadline = started + options.duration
+
+    workers = [Worker(number, options, fixtures, results, started, deadline) for number in range(options.concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # Requests in flight at the deadline finish after it, they are counted and so is their time
+    return results, time.perf_counter() - started
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    rnd = random.Random(options.random_seed)
+    setup_django()
+
+    if not options.no_seed:
+        seed_started = time.perf_counter()
+        seed(options, rnd)
+        print(f'Seeded {options.wallets} wallets and {options.transactions} transactions '
+              f'in {time.perf_counter() - seed_started:.1f}s', file=sys.stderr)
+
+    fixtures = load_fixtures(options)
+    commits_before = database_commits()
+    results, elapsed = run_load(options, fixtures)
+    time.sleep(1)
+    commits_after = database_commits()
+    total = sum(len(samples) for samples in results.values())
+
+    report = {
+        'config': {key: value for key, value in vars(options).items() if key != 'output'},
+        'duration_s': elapsed,
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 2),
+        'operations': summarize(results, elapsed),
+    }
+    if commits_before is not None:
+        # Includes commits of the warmup
+        commits = commits_after - commits_before
+        report['database'] = {'commits': commits, 'commits_per_second': round(commits / (elapsed + options.warmup), 2)}
+
+    output = json.dumps(report, indent=2, default=str)
+    if options.output:
+        with open(options.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()